@@ -4,41 +4,440 @@ Flask app for collecting, storing, and exporting consent responses
 Deploy to: Heroku, Railway, or your own server
 """
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 from datetime import datetime
-import json
+import orjson
 import csv
+import hmac
+import mmap
 import os
 from io import StringIO, BytesIO
-import pandas as pd
+import xlsxwriter
 from pathlib import Path
+from collections import defaultdict
+import threading
+import time
+import queue
+import atexit
+
+try:
+    from gevent import get_hub, monkey as gevent_monkey
+except ImportError:  # e.g. the local dev server
+    gevent_monkey = None
+
+def dump_json(obj):
+    """Serialize obj to JSON bytes"""
+    # Tallies in /api/stats can have a None key for unanswered questions
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+class OrjsonProvider(JSONProvider):
+    """Route jsonify and request.get_json through orjson"""
+    
+    def dumps(self, obj, **kwargs):
+        return dump_json(obj).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # Skip the bytes -> str -> bytes round trip that dumps() implies
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dump_json(obj), mimetype='application/json')
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # Data storage (can be replaced with database)
-RESPONSES_FILE = 'responses.json'
+# One JSON document per line, so new responses can be appended
+RESPONSES_FILE = 'responses.jsonl'
+LEGACY_RESPONSES_FILE = 'responses.json'
+
+# Key required by /api/responses/clear, read once at startup
+ADMIN_API_KEY = os.getenv('ADMIN_API_KEY', 'test-key-change-this').encode('utf-8')
+
+# Legacy files at least this large are memory-mapped instead of read
+MMAP_THRESHOLD = 1024 * 1024
+
+# Pending writes allowed before submissions are refused, and the most
+# responses appended (and fsynced) together by the writer thread
+WRITE_QUEUE_SIZE = 1024
+WRITE_BATCH_SIZE = 256
+
+# Backoff between retries of a failed write, and how long to wait at
+# exit for queued writes to reach the file
+WRITE_RETRY_SECONDS = 1
+WRITE_RETRY_MAX_SECONDS = 30
+WRITE_FLUSH_SECONDS = 10
+
+# Longest string an Excel cell can hold; longer values are clipped
+EXCEL_MAX_STRING = 32767
+
+# Rows serialized per chunk when streaming CSV exports
+CSV_CHUNK_ROWS = 1000
+
+# Design variants shown in the study, in export column order
+VARIANTS = tuple(f'variant-{i}' for i in range(1, 7))
+
+CSV_FIELDS = [
+    'timestamp', 'session_id', 'participant_name', 'participant_email',
+    'department', 'favorite_design', 'most_trusted_design', 'favorite_reason',
+    'concerns', 'total_time_seconds', 'interactions_count',
+] + [f'rating_{variant}' for variant in VARIANTS]
+
+EXCEL_FIELDS = [
+    'Timestamp', 'Session ID', 'Name', 'Email', 'Department', 'Favorite Design',
+    'Most Trusted Design', 'Why Favorite', 'Concerns', 'Time Spent (seconds)',
+    'Interactions',
+] + [f'Rating - Option {i}' for i in range(1, 7)]
+
+# All responses are kept in memory; the file is read once per process,
+# on its first request, so a forked or restarted worker never serves a
+# copy inherited from its parent. Serve with a single (gevent) worker.
+_responses = []
+_lock = threading.Lock()
+_state_pid = None
+
+# Writes are handed to a background thread, started on first use so it
+# is created in the serving process rather than before a fork
+_write_queue = None
+_writer = None
+_write_failing = False
+_TRUNCATE = object()
+
+# Responses grouped by feedback.department, for filtered GETs
+_by_department = defaultdict(list)
+
+# Bumped on every change to the responses and used as the ETag of the
+# read endpoints. The boot id is regenerated by load_state in each
+# serving process, so tags never match across restarts or forks.
+_BOOT_ID = None
+_version = 0
+
+# Serialized bodies of the read endpoints: key -> (etag, body)
+_json_cache = {}
+
+# Shared stand-in for missing nested objects; never mutated
+_EMPTY = {}
+
+# Export rows flattened once per response, in CSV_FIELDS/EXCEL_FIELDS
+# order, and the widest value seen in each column for the Excel export
+_flat_rows = []
+_col_max_len = [len(k) for k in EXCEL_FIELDS]
+
+# Running totals for /api/stats, updated as responses come in
+_ratings_sum = defaultdict(float)
+_ratings_n = defaultdict(int)
+_favorite_counts = defaultdict(int)
+_trust_counts = defaultdict(int)
 
 def load_responses():
     """Load all responses from file"""
     if os.path.exists(RESPONSES_FILE):
-        with open(RESPONSES_FILE, 'r') as f:
-            return json.load(f)
+        responses = []
+        with open(RESPONSES_FILE, 'rb') as f:
+            for line_num, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    responses.append(orjson.loads(line))
+                except orjson.JSONDecodeError:
+                    app.logger.warning('Skipping unreadable line %d of %s', line_num, RESPONSES_FILE)
+        return responses
+    
+    # Migrate responses stored in the old single-document format
+    if os.path.exists(LEGACY_RESPONSES_FILE):
+        with open(LEGACY_RESPONSES_FILE, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < MMAP_THRESHOLD:
+                responses = orjson.loads(f.read())
+            else:
+                # Parse straight from the page cache, without a copy in memory
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    with memoryview(mm) as view:
+                        responses = orjson.loads(view)
+        save_responses(responses)
+        return responses
     return []
 
 def save_responses(responses):
-    """Save responses to file"""
-    with open(RESPONSES_FILE, 'w') as f:
-        json.dump(responses, f, indent=2)
+    """Rewrite the file with the given responses"""
+    write_lines([orjson.dumps(resp) for resp in responses], 'wb')
+
+def append_lines(lines):
+    """Append serialized responses to the file, leaving it unchanged if that fails"""
+    size = os.path.getsize(RESPONSES_FILE) if os.path.exists(RESPONSES_FILE) else 0
+    try:
+        write_lines(lines, 'ab')
+    except Exception:
+        # Drop a partial append so a retry doesn't duplicate lines
+        if os.path.exists(RESPONSES_FILE):
+            os.truncate(RESPONSES_FILE, size)
+        raise
+
+def write_lines(lines, mode):
+    """Write serialized responses, one per line, and flush them to disk"""
+    with open(RESPONSES_FILE, mode) as f:
+        f.write(b''.join(line + b'\n' for line in lines))
+        f.flush()
+        os.fsync(f.fileno())
+
+def write_batch(batch):
+    """Persist a batch taken from the write queue"""
+    # Anything queued before a clear is gone; rewrite with what follows
+    if _TRUNCATE in batch:
+        last = len(batch) - 1 - batch[::-1].index(_TRUNCATE)
+        write_lines(batch[last + 1:], 'wb')
+    else:
+        append_lines(batch)
+
+def run_blocking(func, *args):
+    """Call func, on a real OS thread if gevent is active so disk waits don't stall other requests"""
+    if gevent_monkey is not None and gevent_monkey.is_module_patched('threading'):
+        return get_hub().threadpool.apply(func, args)
+    return func(*args)
+
+def write_loop():
+    """Drain the write queue, persisting whatever has accumulated"""
+    global _write_failing
+    while True:
+        batch = [_write_queue.get()]
+        while len(batch) < WRITE_BATCH_SIZE:
+            try:
+                batch.append(_write_queue.get_nowait())
+            except queue.Empty:
+                break
+        
+        # These responses were already acknowledged, so don't drop them on a
+        # disk error: retry until the write succeeds, refusing new writes meanwhile.
+        # The batch is already serialized, so anything else is a bug, not the disk.
+        delay = WRITE_RETRY_SECONDS
+        while True:
+            try:
+                run_blocking(write_batch, batch)
+                break
+            except OSError:
+                _write_failing = True
+                app.logger.exception('Failed to write %d responses, retrying in %s seconds', len(batch), delay)
+                time.sleep(delay)
+                delay = min(delay * 2, WRITE_RETRY_MAX_SECONDS)
+            except Exception:
+                app.logger.exception('Dropping a batch of %d responses that cannot be written', len(batch))
+                break
+        
+        _write_failing = False
+        for _ in batch:
+            _write_queue.task_done()
+
+def queue_write(item):
+    """Hand a serialized response (or _TRUNCATE) to the writer; False if it is backed up or failing"""
+    global _write_queue, _writer
+    if _write_failing:
+        return False
+    if _writer is None:
+        _write_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        _writer = threading.Thread(target=write_loop, name='response-writer', daemon=True)
+        _writer.start()
+    try:
+        _write_queue.put_nowait(item)
+    except queue.Full:
+        return False
+    return True
+
+@atexit.register
+def flush_writes():
+    """Wait (for a while) for queued responses to reach the file before exiting"""
+    if _writer is None:
+        return
+    deadline = time.monotonic() + WRITE_FLUSH_SECONDS
+    while _write_queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.05)
+    if _write_queue.unfinished_tasks:
+        app.logger.error('Exiting with %d responses not written', _write_queue.unfinished_tasks)
+
+def validate_response(resp):
+    """Why resp can't be stored, or None if it is safe to remember"""
+    if not isinstance(resp, dict):
+        return 'Response must be a JSON object'
+    if 'feedback' not in resp or 'ratings' not in resp:
+        return 'Missing required fields'
+    if not isinstance(resp['feedback'], dict) or not isinstance(resp['ratings'], dict):
+        return 'feedback and ratings must be objects'
+    
+    # flatten_response reads these as an object and a list
+    if not isinstance(resp.get('timeSpent') or _EMPTY, dict):
+        return 'timeSpent must be an object'
+    if not isinstance(resp.get('interactions') or [], list):
+        return 'interactions must be a list'
+    
+    # These become dict keys in the department index and the stats tallies
+    for key in ('department', 'favorite', 'mostTrusted'):
+        value = resp['feedback'].get(key)
+        if value is not None and not isinstance(value, str):
+            return f'feedback.{key} must be a string'
+    return None
+
+def export_cell(value):
+    """value as something both csv and xlsxwriter can write"""
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    # Nested objects and lists are exported as their JSON text
+    return dump_json(value).decode('utf-8')
+
+def flatten_response(resp):
+    """Flatten a response into one export row"""
+    feedback = resp.get('feedback') or _EMPTY
+    ratings = resp.get('ratings') or _EMPTY
+    flat_row = [
+        resp.get('timestamp'),
+        resp.get('sessionId'),
+        feedback.get('participantName', ''),
+        feedback.get('participantEmail', ''),
+        feedback.get('department', ''),
+        feedback.get('favorite', ''),
+        feedback.get('mostTrusted', ''),
+        feedback.get('favoriteReason', ''),
+        feedback.get('concerns', ''),
+        (resp.get('timeSpent') or _EMPTY).get('totalSeconds', 0),
+        len(resp.get('interactions') or ()),
+    ]
+    
+    # Add individual ratings
+    flat_row.extend([ratings.get(variant, 0) for variant in VARIANTS])
+    
+    return tuple([export_cell(value) for value in flat_row])
+
+def remember_response(response, flat_row):
+    """Add a response and its export row to the in-memory state (caller holds the lock)"""
+    global _version
+    _version += 1
+    _responses.append(response)
+    _flat_rows.append(flat_row)
+    
+    for i, value in enumerate(flat_row):
+        length = len(str(value))
+        if length > _col_max_len[i]:
+            _col_max_len[i] = length
+    
+    for variant, rating in (response.get('ratings') or _EMPTY).items():
+        # Skip malformed ratings rather than poisoning the running sums
+        if isinstance(rating, (int, float)):
+            _ratings_sum[variant] += rating
+            _ratings_n[variant] += 1
+    
+    feedback = response.get('feedback') or _EMPTY
+    _by_department[feedback.get('department')].append(response)
+    _favorite_counts[feedback.get('favorite')] += 1
+    _trust_counts[feedback.get('mostTrusted')] += 1
+
+def forget_responses():
+    """Drop all in-memory state (caller holds the lock)"""
+    global _version
+    _version += 1
+    _responses.clear()
+    _flat_rows.clear()
+    _col_max_len[:] = [len(k) for k in EXCEL_FIELDS]
+    for totals in (_by_department, _ratings_sum, _ratings_n, _favorite_counts, _trust_counts):
+        totals.clear()
+
+def snapshot_responses():
+    """Copy of the in-memory responses, safe to iterate outside the lock"""
+    with _lock:
+        return list(_responses)
+
+def current_etag():
+    """ETag for the current version of the responses"""
+    return f'{_BOOT_ID}-{_version}'
+
+def cached_json(key, snapshot):
+    """(etag, body) for key, serializing snapshot() at most once per version"""
+    cached = _json_cache.get(key)
+    if cached is not None and cached[0] == current_etag():
+        return cached
+    
+    # Take the data and its tag together, but serialize outside the lock
+    with _lock:
+        tag = current_etag()
+        obj = snapshot()
+    cached = (tag, dump_json(obj))
+    _json_cache[key] = cached
+    return cached
+
+def etag_response(tag, body=None):
+    """JSON response tagged with tag, or 304 if the client already has it"""
+    if request.if_none_match.contains_weak(tag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, mimetype='application/json')
+    response.set_etag(tag, weak=True)
+    return response
+
+# (epoch second, isoformat string) of the last timestamp handed out
+_ts_cache = (0, '')
+
+def now_iso():
+    """Current local time in ISO format, to the second, reused within a second"""
+    global _ts_cache
+    t = int(time.time())
+    cached_t, cached_iso = _ts_cache
+    if t != cached_t:
+        cached_iso = datetime.fromtimestamp(t).isoformat()
+        _ts_cache = (t, cached_iso)
+    return cached_iso
+
+def stream_download(chunks, mimetype, extension):
+    """Stream chunks to the client as a file download"""
+    filename = f'consent_responses_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{extension}'
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+def load_state():
+    """Replace the in-memory state with what is in the file"""
+    global _state_pid, _write_queue, _writer, _write_failing, _BOOT_ID
+    with _lock:
+        if _state_pid == os.getpid():
+            return
+        
+        # A forked process inherits its parent's state but not its writer thread
+        forget_responses()
+        _write_queue = None
+        _writer = None
+        _write_failing = False
+        _BOOT_ID = f'{os.getpid():x}.{time.time_ns():x}'
+        _json_cache.clear()
+        
+        for resp in load_responses():
+            # A bad stored response is skipped so it can't keep the app from starting
+            try:
+                error = validate_response(resp)
+                flat_row = None if error else flatten_response(resp)
+            except Exception as e:
+                error = str(e)
+            if error:
+                app.logger.warning('Skipping stored response %r: %s',
+                                   resp.get('sessionId') if isinstance(resp, dict) else None, error)
+                continue
+            remember_response(resp, flat_row)
+        
+        _state_pid = os.getpid()
+
+@app.before_request
+def ensure_state():
+    """Load the responses in whichever process is serving the request"""
+    if _state_pid != os.getpid():
+        load_state()
 
 @app.route('/api/health', methods=['GET'])
 def health():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
-        'timestamp': datetime.now().isoformat(),
-        'responses_count': len(load_responses())
+        'timestamp': now_iso(),
+        'responses_count': len(_responses)
     })
 
 @app.route('/api/responses', methods=['POST'])
@@ -50,25 +449,36 @@ def submit_response():
         if not data:
             return jsonify({'error': 'No data provided'}), 400
         
-        # Validate required fields
-        if 'feedback' not in data or 'ratings' not in data:
-            return jsonify({'error': 'Missing required fields'}), 400
+        # Validate everything remember_response relies on before queuing the write
+        error = validate_response(data)
+        if error:
+            return jsonify({'error': error}), 400
         
         # Add server-side timestamp
-        data['server_timestamp'] = datetime.now().isoformat()
+        data['server_timestamp'] = now_iso()
         
-        # Load existing responses
-        responses = load_responses()
-        responses.append(data)
+        # Serialize here so the writer only ever gets bytes it can write;
+        # orjson parses deeper nesting than it will serialize, for one
+        try:
+            line = orjson.dumps(data)
+        except orjson.JSONEncodeError:
+            return jsonify({'error': 'Response cannot be stored as JSON'}), 400
         
-        # Save
-        save_responses(responses)
+        # Flatten before taking the lock; validation means this can't fail
+        flat_row = flatten_response(data)
+        
+        # Queue the write first so memory never holds a response the file won't
+        with _lock:
+            if not queue_write(line):
+                return jsonify({'error': 'Server busy, please retry'}), 503
+            remember_response(data, flat_row)
+            total = len(_responses)
         
         return jsonify({
             'success': True,
             'message': 'Response recorded',
             'response_id': data.get('sessionId'),
-            'total_responses': len(responses)
+            'total_responses': total
         }), 201
         
     except Exception as e:
@@ -78,17 +488,24 @@ def submit_response():
 def get_responses():
     """Get all responses (with optional filtering)"""
     try:
-        responses = load_responses()
+        tag = current_etag()
+        if request.if_none_match.contains_weak(tag):
+            return etag_response(tag)
         
         # Optional: filter by department
         department = request.args.get('department')
         if department:
-            responses = [r for r in responses if r.get('feedback', {}).get('department') == department]
+            with _lock:
+                tag = current_etag()
+                responses = list(_by_department.get(department, ()))
+            body = dump_json({'total': len(responses), 'responses': responses})
+        else:
+            tag, body = cached_json('responses', lambda: {
+                'total': len(_responses),
+                'responses': list(_responses)
+            })
         
-        return jsonify({
-            'total': len(responses),
-            'responses': responses
-        }), 200
+        return etag_response(tag, body)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -97,18 +514,16 @@ def get_responses():
 def export_json():
     """Export all responses as JSON"""
     try:
-        responses = load_responses()
+        responses = snapshot_responses()
         
-        output = BytesIO()
-        output.write(json.dumps(responses, indent=2).encode('utf-8'))
-        output.seek(0)
+        # Serialize one response at a time instead of the whole list
+        def generate():
+            yield b'['
+            for i, resp in enumerate(responses):
+                yield (b',\n' if i else b'\n') + orjson.dumps(resp, option=orjson.OPT_INDENT_2)
+            yield b'\n]\n'
         
-        return send_file(
-            output,
-            mimetype='application/json',
-            as_attachment=True,
-            download_name=f'consent_responses_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
-        )
+        return stream_download(generate(), 'application/json', 'json')
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -116,45 +531,23 @@ def export_json():
 def export_csv():
     """Export responses as CSV"""
     try:
-        responses = load_responses()
-        
-        # Flatten nested data for CSV
-        flat_data = []
-        for resp in responses:
-            flat_row = {
-                'timestamp': resp.get('timestamp'),
-                'session_id': resp.get('sessionId'),
-                'participant_name': resp.get('feedback', {}).get('participantName', ''),
-                'participant_email': resp.get('feedback', {}).get('participantEmail', ''),
-                'department': resp.get('feedback', {}).get('department', ''),
-                'favorite_design': resp.get('feedback', {}).get('favorite', ''),
-                'most_trusted_design': resp.get('feedback', {}).get('mostTrusted', ''),
-                'favorite_reason': resp.get('feedback', {}).get('favoriteReason', ''),
-                'concerns': resp.get('feedback', {}).get('concerns', ''),
-                'total_time_seconds': resp.get('timeSpent', {}).get('totalSeconds', 0),
-                'interactions_count': len(resp.get('interactions', [])),
-            }
-            
-            # Add individual ratings
-            for variant in ['variant-1', 'variant-2', 'variant-3', 'variant-4', 'variant-5', 'variant-6']:
-                flat_row[f'rating_{variant}'] = resp.get('ratings', {}).get(variant, 0)
-            
-            flat_data.append(flat_row)
+        with _lock:
+            flat_data = list(_flat_rows)
         
-        # Create DataFrame
-        df = pd.DataFrame(flat_data)
+        # Write rows straight to CSV, sending the buffer every few rows
+        def generate():
+            buffer = StringIO()
+            writer = csv.writer(buffer, lineterminator='\n')
+            writer.writerow(CSV_FIELDS)
+            for start in range(0, len(flat_data), CSV_CHUNK_ROWS):
+                writer.writerows(flat_data[start:start + CSV_CHUNK_ROWS])
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue().encode('utf-8')
         
-        # Convert to CSV
-        output = BytesIO()
-        df.to_csv(output, index=False, encoding='utf-8')
-        output.seek(0)
-        
-        return send_file(
-            output,
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=f'consent_responses_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-        )
+        return stream_download(generate(), 'text/csv', 'csv')
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -162,55 +555,37 @@ def export_csv():
 def export_excel():
     """Export responses as Excel (.xlsx)"""
     try:
-        responses = load_responses()
+        with _lock:
+            flat_data = list(_flat_rows)
+            col_max_len = list(_col_max_len)
         
-        # Flatten data
-        flat_data = []
-        for resp in responses:
-            flat_row = {
-                'Timestamp': resp.get('timestamp'),
-                'Session ID': resp.get('sessionId'),
-                'Name': resp.get('feedback', {}).get('participantName', ''),
-                'Email': resp.get('feedback', {}).get('participantEmail', ''),
-                'Department': resp.get('feedback', {}).get('department', ''),
-                'Favorite Design': resp.get('feedback', {}).get('favorite', ''),
-                'Most Trusted Design': resp.get('feedback', {}).get('mostTrusted', ''),
-                'Why Favorite': resp.get('feedback', {}).get('favoriteReason', ''),
-                'Concerns': resp.get('feedback', {}).get('concerns', ''),
-                'Time Spent (seconds)': resp.get('timeSpent', {}).get('totalSeconds', 0),
-                'Interactions': len(resp.get('interactions', [])),
-            }
-            
-            # Add ratings
-            for variant_num in range(1, 7):
-                variant = f'variant-{variant_num}'
-                flat_row[f'Rating - Option {variant_num}'] = resp.get('ratings', {}).get(variant, 0)
-            
-            flat_data.append(flat_row)
+        # Write rows in order so xlsxwriter can flush each one to disk
+        output = BytesIO()
+        # Participant free text stays text: never a hyperlink or a live formula
+        workbook = xlsxwriter.Workbook(output, {
+            'constant_memory': True,
+            'strings_to_urls': False,
+            'strings_to_formulas': False,
+        })
+        ws = workbook.add_worksheet('Responses')
+        header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
         
-        # Create DataFrame
-        df = pd.DataFrame(flat_data)
+        ws.write_row(0, 0, EXCEL_FIELDS, header_format)
+        # Cell by cell, since write_row gives up on the rest of a row at the
+        # first cell it cannot write
+        for row_num, flat_row in enumerate(flat_data, start=1):
+            for col_num, value in enumerate(flat_row):
+                if isinstance(value, str) and len(value) > EXCEL_MAX_STRING:
+                    value = value[:EXCEL_MAX_STRING]
+                if ws.write(row_num, col_num, value):
+                    app.logger.warning('Could not write %s for row %d of the Excel export',
+                                       EXCEL_FIELDS[col_num], row_num)
         
-        # Write to Excel with formatting
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Responses')
-            
-            # Get worksheet
-            ws = writer.sheets['Responses']
-            
-            # Auto-adjust column widths
-            for column in ws.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                ws.column_dimensions[column_letter].width = min(max_length + 2, 50)
+        # Auto-adjust column widths
+        for col_num, max_length in enumerate(col_max_len):
+            ws.set_column(col_num, col_num, min(max_length + 2, 50))
         
+        workbook.close()
         output.seek(0)
         
         return send_file(
@@ -226,57 +601,48 @@ def export_excel():
 def get_stats():
     """Get aggregate statistics"""
     try:
-        responses = load_responses()
-        
-        if not responses:
-            return jsonify({'message': 'No responses yet'}), 200
-        
-        # Calculate stats
-        ratings_avg = {}
-        favorite_counts = {}
-        trust_counts = {}
+        tag = current_etag()
+        if request.if_none_match.contains_weak(tag):
+            return etag_response(tag)
         
-        for resp in responses:
-            # Average ratings
-            ratings = resp.get('ratings', {})
-            for variant, rating in ratings.items():
-                if variant not in ratings_avg:
-                    ratings_avg[variant] = []
-                ratings_avg[variant].append(rating)
-            
-            # Count favorites
-            favorite = resp.get('feedback', {}).get('favorite')
-            favorite_counts[favorite] = favorite_counts.get(favorite, 0) + 1
-            
-            # Count most trusted
-            trust = resp.get('feedback', {}).get('mostTrusted')
-            trust_counts[trust] = trust_counts.get(trust, 0) + 1
-        
-        # Calculate averages
-        for variant in ratings_avg:
-            ratings_avg[variant] = round(sum(ratings_avg[variant]) / len(ratings_avg[variant]), 2)
-        
-        return jsonify({
-            'total_responses': len(responses),
-            'average_ratings': ratings_avg,
-            'favorite_counts': favorite_counts,
-            'most_trusted_counts': trust_counts,
-            'last_response': responses[-1].get('timestamp') if responses else None
-        }), 200
+        tag, body = cached_json('stats', build_stats)
+        return etag_response(tag, body)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def build_stats():
+    """Aggregate statistics from the running totals (caller holds the lock)"""
+    if not _responses:
+        return {'message': 'No responses yet'}
+    
+    # Averages come from the running totals kept by remember_response
+    ratings_avg = {
+        variant: round(_ratings_sum[variant] / _ratings_n[variant], 2)
+        for variant in _ratings_n
+    }
+    return {
+        'total_responses': len(_responses),
+        'average_ratings': ratings_avg,
+        'favorite_counts': dict(_favorite_counts),
+        'most_trusted_counts': dict(_trust_counts),
+        'last_response': _responses[-1].get('timestamp')
+    }
+
 @app.route('/api/responses/clear', methods=['POST'])
 def clear_responses():
     """Clear all responses (for testing only - protect in production)"""
     # Add authentication in production
-    api_key = request.headers.get('X-API-Key')
-    if api_key != os.getenv('ADMIN_API_KEY', 'test-key-change-this'):
+    api_key = request.headers.get('X-API-Key', '').encode('utf-8')
+    if not hmac.compare_digest(api_key, ADMIN_API_KEY):
         return jsonify({'error': 'Unauthorized'}), 401
     
-    save_responses([])
+    with _lock:
+        if not queue_write(_TRUNCATE):
+            return jsonify({'error': 'Server busy, please retry'}), 503
+        forget_responses()
     return jsonify({'success': True, 'message': 'All responses cleared'}), 200
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Local development only; production runs under gunicorn (see Procfile)
+    app.run(debug=os.getenv('FLASK_DEBUG') == '1', host='0.0.0.0', port=5000)